@@ -1,13 +1,27 @@
 """ monkey patch some Python 3.7/3.8 stuff into earlier versions """
 
-import re
 import sys
 import asyncio
 import warnings
 import logging
 
 
-def asyncio_run(task, debug=False):
+def install_uvloop():
+    """ switch to uvloop's event loop policy if it is installed """
+
+    try:
+        import uvloop
+    except ImportError:
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def asyncio_run(task, debug=False, use_uvloop=True):
+    if use_uvloop:
+        install_uvloop()
+
     try:
         loop = asyncio.get_event_loop()
     except Exception:
@@ -33,36 +47,42 @@ def asyncio_run(task, debug=False):
 def task_get_name(self):
     """ asyncio.tasks.Task.get_name """
 
-    match = re.search(r"coro=<(\S+)", repr(self))
-    return match.group(1).replace('.<locals>', '')
+    # Task.get_coro is 3.8+
+    coro = self.get_coro() if hasattr(self, "get_coro") else self._coro
+    return coro.__qualname__.replace('.<locals>', '')
 
 
 async def wait_gracefully(tasks, timeout=None):
     """
-    wait for tasks to complete issuing cancels to any still pending until done
+    wait for tasks to complete cancelling any still pending after timeout
     to ensure exceptions and results are always consumed
     """
 
-    while True:
-        done, pending = await asyncio.wait(tasks, timeout=timeout)
-
-        for t in done:
-            if t.exception():
-                print("exception:", task_get_name(t), t.exception())
-            elif t.result():
-                print("result:", task_get_name(t), t.result())
+    try:
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout)
+    except asyncio.TimeoutError:
+        pass
 
-        if not pending:
-            break
+    # on timeout wait_for cancels the gather which cancels the pending tasks
+    results = await asyncio.gather(*tasks, return_exceptions=True)
 
-        for t in pending:
-            t.cancel()
+    for t, result in zip(tasks, results):
+        if isinstance(result, asyncio.CancelledError):
+            continue
+        if isinstance(result, BaseException):
+            print("exception:", task_get_name(t), result)
+        elif result:
+            print("result:", task_get_name(t), result)
 
-        tasks = pending
 
+def patch(use_uvloop=True):
+    """
+    monkey patch some Python 3.7/3.8 stuff into earlier versions and use uvloop
+    when available
+    """
 
-def patch():
-    """ monkey patch some Python 3.7/3.8 stuff into earlier versions """
+    if use_uvloop:
+        install_uvloop()
 
     version = sys.version_info.major * 10 + sys.version_info.minor
 
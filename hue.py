@@ -6,113 +6,22 @@ backbone of the next remote control system
 """
 
 import os
-import time
 import logging
 import asyncio
-import aioredis
-from collections import namedtuple
-from sshtunnel import SSHTunnelForwarder
 
 from aiotools import patch, wait_gracefully
 from phue import Bridge
-
-Message = namedtuple("Message", "source, key, value")
+from poc import DotPattern, Message, RedisMessageBus
 
 logger = logging.getLogger(__name__)
 
 
-def ts():
-    return time.time()
-
-
-class MessageBus:
-    """ MessageBus interface """
-
-    async def send(self, message):
-        pass
-
-    async def listen(self, pattern):
-        pass
-
-    async def close(self):
-        pass
-
-
-# todo: should this be initialized with a mask to restrict the namespace?
-# todo: using patterns makes many of the status metrics unavailable.
-# todo: Should there just be a single channel?
-class RedisMessageBus(MessageBus):
-    """ A MessageBus implemented as a Redis pubsub channel """
-
-    def __init__(self, pattern):
-        super().__init__()
-        self.tunnel = None
-        self.aredis = None
-        self.pattern = pattern
-
-    async def connect(self, tunnel_config):
-        def create_tunnel():
-            self.tunnel = SSHTunnelForwarder(**tunnel_config)
-            self.tunnel.start()
-
-        await asyncio.get_event_loop().run_in_executor(None, create_tunnel)
-
-        address = self.tunnel.local_bind_address
-        self.aredis = await aioredis.create_redis_pool(address, encoding="utf-8")
-        logger.info(f"Redis connected: {self.aredis.address}")
-
-    def redis_pattern(self):
-        return self.pattern + "*" if self.pattern.endswith('.') else self.pattern
-
-    async def send(self, message):
-        if not self.aredis:
-            raise RuntimeError("Redis not connected")
-
-        if message.key.endswith("."):
-            raise ValueError("trailing '.' in key")
-
-        logger.info(f"Redis send: {message}:{message.value}")
-        await self.aredis.publish(message.key, message.value)
-
-    async def listen(self, pattern='*'):
-        if not self.aredis:
-            raise RuntimeError("Redis not connected")
-
-        try:
-            chan, = await self.aredis.psubscribe(self.redis_pattern())
-            while await chan.wait_message():
-                k, v = await chan.get(encoding="utf-8")
-                yield Message("redis", k.decode(), v)
-        except Exception:
-            raise
-
-    async def status(self):
-        if self.aredis:
-
-            return {
-                "status": "connected",
-                "patterns": list(self.aredis.patterns.keys()),
-                "timestamp": ts(),
-            }
-        else:
-            return {"status": "disconnected"}
-
-    async def close(self):
-        self.aredis.close()
-        await self.aredis.wait_closed()
-        self.aredis = None
-
-        # this is slow so run in a thread pool
-        await asyncio.get_event_loop().run_in_executor(None, self.tunnel.stop)
-        self.tunnel = None
-        logger.info(f"Redis connection closed")
-
-
 class HueComponent:
-    """ bridge Yamaha YNCA component onto MessageBus """
+    """ bridge Philips Hue component onto MessageBus """
 
-    def __init__(self, bridge_hostname, bus):
+    def __init__(self, bridge_hostname, bus, pattern="hue."):
         self.bus = bus
+        self.pattern = pattern
         self.bridge = Bridge(bridge_hostname)
 
         # start up the listener
@@ -121,8 +30,7 @@ class HueComponent:
     async def listen(self):
         """ listen for commands and relay them to the component """
         try:
-            async for message in self.bus.listen():
-                if message.message.startswith("
+            async for message in self.bus.listen(self.pattern):
                 print(f"Bridge:", message)
         except asyncio.CancelledError:
             pass
@@ -146,11 +54,16 @@ async def main():
                 await asyncio.sleep(0.35)
                 await bus.send(Message("local", k, v))
 
-    async def listen(bus, pattern):
+    async def listen(bus, patterns):
+        """ a single bus subscription dispatched locally to each pattern """
+
         await asyncio.sleep(1.5)
+        matchers = [DotPattern(p) for p in patterns]
         try:
-            async for message in bus.listen(pattern):
-                print(f"listen({pattern}):", message)
+            async for message in bus.listen("."):
+                for p in matchers:
+                    if p.match(message.key):
+                        print(f"listen({p}):", message)
         except asyncio.CancelledError:
             pass
 
@@ -181,9 +94,7 @@ async def main():
 
     tasks = [asyncio.create_task(c) for c in (
         talk(ps, ("cat.dog", "cat.pig", "cow.emu")),
-        listen(ps, "."),
-        listen(ps, "cat."),
-        listen(ps, "cat.pig"),
+        listen(ps, (".", "cat.", "cat.pig")),
         monitor(),
     )]
 
@@ -200,7 +111,7 @@ if __name__ == "__main__":
     handler = logging.StreamHandler()
     try:
         logger.addHandler(handler)
-        asyncio.run(main(), debug=True)
+        asyncio.run(main(), debug=False)
     finally:
         logger.removeHandler(handler)
     print("all: done")
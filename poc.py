@@ -8,22 +8,66 @@ backbone of the next remote control system
 import os
 import re
 import time
+import functools
 import logging
 import asyncio
 import aioredis
-from collections import namedtuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from sshtunnel import SSHTunnelForwarder
 
 from aiotools import patch, wait_gracefully
 from yamaha import Yamaha
 
-Message = namedtuple("Message", "source, key, value")
-
 logger = logging.getLogger(__name__)
 
+# max messages pipelined into a single redis round-trip and how long (sec) the
+# flusher lingers to let a burst accumulate before sending
+REDIS_BATCH_SIZE = 100
+REDIS_BATCH_WAIT = 0.005
+
+# connections kept open in the shared pool so concurrent publish and subscribe
+# traffic doesn't serialize on a single connection
+REDIS_POOL_SIZE = 4
+
+# blocking ssh tunnel start/stop runs here rather than in the loop's default executor
+_SSH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ssh")
+
+
+# offset from the monotonic clock the event loop runs on to wall-clock time
+_TS_OFFSET = time.time() - time.monotonic()
+
 
 def ts():
-    return time.time()
+    """ wall-clock timestamp read off the running loop's clock """
+    return _TS_OFFSET + asyncio.get_running_loop().time()
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(pattern, flags=0):
+    """ compiled regex memoized by pattern string so listener churn doesn't recompile """
+    return re.compile(pattern, flags)
+
+
+class Message:
+    """ a bus message.  the upper-cased key used for routing is computed once on demand """
+
+    __slots__ = ("source", "key", "value", "_key_upper")
+
+    def __init__(self, source, key, value):
+        self.source = source
+        self.key = key
+        self.value = value
+        self._key_upper = None
+
+    @property
+    def key_upper(self):
+        if self._key_upper is None:
+            self._key_upper = self.key.upper()
+        return self._key_upper
+
+    def __repr__(self):
+        return f"Message(source={self.source!r}, key={self.key!r}, value={self.value!r})"
 
 
 class RegexPattern:
@@ -31,7 +75,7 @@ class RegexPattern:
 
     def __init__(self, pattern):
         self.pattern = pattern
-        self.regex = re.compile(pattern)
+        self.regex = _compile(pattern)
 
     def match(self, subject):
         return self.regex.fullmatch(subject)
@@ -46,17 +90,167 @@ class DotPattern:
     def __init__(self, pattern):
         self.pattern = pattern
 
+        # compile to a case-insensitive regex so matching runs entirely in _sre.
+        # match() is anchored at the start so prefix patterns stop at the prefix
+        # boundary rather than scanning the rest of the key
+        if pattern in ("", "."):
+            # catch-all listeners are common so skip the regex entirely
+            self.regex = None
+            self.match = self._match_all
+            return
+
+        if pattern.endswith("."):
+            expr = re.escape(pattern)
+        else:
+            expr = re.escape(pattern) + r"\Z"
+        self.regex = _compile(expr, re.IGNORECASE)
+
     def match(self, subject):
-        if self.pattern.upper() == subject.upper() or self.pattern in ("", "."):
-            return True
+        return self.regex.match(subject) is not None
 
-        prefix = self.pattern + "" if self.pattern[-1] == "." else "."
-        return subject.upper().startswith(prefix.upper())
+    @staticmethod
+    def _match_all(subject):
+        return True
 
     def __str__(self):
         return self.pattern
 
 
+class FastQueue:
+    """
+    unbounded single-consumer queue for bus fan-out.  a deque plus one waiter
+    future without asyncio.Queue's getter/putter bookkeeping
+    """
+
+    __slots__ = ("_dq", "_waiter")
+
+    def __init__(self):
+        self._dq = deque()
+        self._waiter = None
+
+    def put_nowait(self, item):
+        self._dq.append(item)
+
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def get_batch(self):
+        """ wait for and take everything queued in one go """
+
+        while not self._dq:
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+
+        batch, self._dq = self._dq, deque()
+        return batch
+
+
+class ListenerTrie:
+    """
+    listener queues and last channel values indexed by dot-separated key component.
+    DotPattern semantics: patterns ending in '.' (or the catch-all '' and '.') match
+    every key beneath them, anything else matches the exact key.  case insensitive
+    """
+
+    class Node:
+        __slots__ = ("children", "prefix", "exact", "values")
+
+        def __init__(self):
+            self.children = {}
+            self.prefix = set()
+            self.exact = set()
+            self.values = None
+
+    def __init__(self):
+        self.root = self.Node()
+
+    @staticmethod
+    def _parts(pattern):
+        pattern = pattern.upper()
+        if pattern in ("", "."):
+            return [], True
+        return pattern.rstrip(".").split("."), pattern.endswith(".")
+
+    def add(self, pattern, q):
+        """ register q under pattern """
+
+        parts, prefix = self._parts(pattern)
+        node = self.root
+        for part in parts:
+            node = node.children.setdefault(part, self.Node())
+
+        (node.prefix if prefix else node.exact).add(q)
+
+    def remove(self, pattern, q):
+        """ unregister q from pattern pruning any branch left empty """
+
+        parts, prefix = self._parts(pattern)
+        path = [self.root]
+        for part in parts:
+            path.append(path[-1].children[part])
+
+        node = path[-1]
+        (node.prefix if prefix else node.exact).discard(q)
+
+        for parent, part, node in zip(reversed(path[:-1]), reversed(parts), reversed(path)):
+            if node.children or node.prefix or node.exact or node.values:
+                break
+            del parent.children[part]
+
+    def set_value(self, key, value):
+        """ record the last value sent on key """
+
+        node = self.root
+        for part in key.upper().split("."):
+            node = node.children.setdefault(part, self.Node())
+
+        if node.values is None:
+            node.values = {}
+        node.values[key] = value
+
+    def values(self, pattern):
+        """ list the (key, value) pairs stored under pattern walking only the matching subtree """
+
+        parts, prefix = self._parts(pattern)
+        node = self.root
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                return []
+
+        if not prefix:
+            return list(node.values.items()) if node.values else []
+
+        # depth first taking children in the order they were added.  pushed
+        # reversed so the first added comes off the stack first
+        results = []
+        stack = list(reversed(node.children.values()))
+        while stack:
+            node = stack.pop()
+            if node.values:
+                results.extend(node.values.items())
+            stack.extend(reversed(node.children.values()))
+
+        return results
+
+    def match(self, key_upper):
+        """ return the queues listening to the already upper-cased key """
+
+        node = self.root
+        queues = []
+        for part in key_upper.split("."):
+            queues.extend(node.prefix)
+            node = node.children.get(part)
+            if node is None:
+                return queues
+
+        queues.extend(node.exact)
+        return queues
+
+
 class MessageBus:
     """ MessageBus interface """
 
@@ -77,10 +271,12 @@ class BasicMessageBus(MessageBus):
         super().__init__()
         self.conn = None
         self._channels = {}
-        self.listeners = set()
+        self.listeners = {}
+        self._trie = ListenerTrie()
 
     def set_channel(self, key, value):
         self._channels[key] = value
+        self._trie.set_value(key, value)
 
     def get_channels(self):
         return self._channels.items()
@@ -97,42 +293,43 @@ class BasicMessageBus(MessageBus):
             raise ValueError("trailing '.' in key")
 
         self.set_channel(message.key, message.value)
-        for pattern, q in self.listeners:
-            if pattern.match(message.key):
-                await q.put(message)
+        # listener queues are unbounded so put_nowait never blocks
+        for q in self._trie.match(message.key_upper):
+            q.put_nowait(message)
 
     async def listen(self, pattern):
         if not self.conn:
             raise RuntimeError("bus not connected")
 
         p = DotPattern(pattern)
-        q = asyncio.Queue()
+        q = FastQueue()
 
-        try:
-            self.listeners.add((p, q))
+        self.listeners[id(q)] = (p, q)
+        self._trie.add(pattern, q)
 
+        try:
             # yield current values
-            for k, v in self.get_channels():
-                if p.match(k):
-                    yield Message("local", k, v)
+            for k, v in self._trie.values(pattern):
+                yield Message("local", k, v)
 
-            # yield the messages as they come through
+            # yield the messages as they come through draining any backlog per wake-up
             while True:
-                msg = await q.get()
-                if not msg:
-                    logger.info(f"listener {pattern}: null message received.  done.")
-                    break
-                yield msg
+                for msg in await q.get_batch():
+                    if not msg:
+                        logger.info(f"listener {pattern}: null message received.  done.")
+                        return
+                    yield msg
         except asyncio.CancelledError:
             logger.info(f"listener {pattern}: cancelled")
         finally:
-            self.listeners.remove((p, q))
+            self.listeners.pop(id(q), None)
+            self._trie.remove(pattern, q)
 
     async def status(self):
         if self.conn:
             return {
                 "status": "connected",
-                "listeners": [str(p) for p, _ in self.listeners],
+                "listeners": [str(p) for p, _ in self.listeners.values()],
                 "channels": list(self.get_channels()),
                 "timestamp": ts(),
             }
@@ -142,12 +339,137 @@ class BasicMessageBus(MessageBus):
     async def close(self):
         """ send all listeners a null message and close the bus """
 
-        for p, q in self.listeners:
-            await q.put(None)
+        for p, q in self.listeners.values():
+            q.put_nowait(None)
         self.conn = None
         logger.info(f"bus: connection closed")
 
 
+class RedisConnection:
+    """
+    ssh tunnel and aioredis pool shared by everything connecting with the same
+    tunnel config.  aioredis hands every psubscribe of a glob the same Channel so
+    subscriptions live here too, one per glob, fanned out to a queue per listener
+    """
+
+    _shared = {}
+    _lock = None
+
+    def __init__(self, key):
+        self.key = key
+        self.tunnel = None
+        self.aredis = None
+        self.refs = 0
+        # glob -> (reader task, listener queues)
+        self._subscriptions = {}
+        self._sub_lock = asyncio.Lock()
+
+    @classmethod
+    async def acquire(cls, tunnel_config):
+        """ return the shared connection for tunnel_config opening it on first use """
+
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+
+        key = tuple(sorted(tunnel_config.items()))
+        async with cls._lock:
+            connection = cls._shared.get(key)
+            if connection is None:
+                connection = cls(key)
+                await connection.open(tunnel_config)
+                cls._shared[key] = connection
+
+            connection.refs += 1
+            return connection
+
+    async def open(self, tunnel_config):
+        def create_tunnel():
+            self.tunnel = SSHTunnelForwarder(**tunnel_config)
+            self.tunnel.start()
+
+        await asyncio.get_running_loop().run_in_executor(_SSH_EXECUTOR, create_tunnel)
+
+        address = self.tunnel.local_bind_address
+        self.aredis = await aioredis.create_redis_pool(
+            address, encoding="utf-8", minsize=REDIS_POOL_SIZE, maxsize=REDIS_POOL_SIZE * 2)
+        logger.info(f"Redis connected: {self.aredis.address}")
+
+    async def subscribe(self, glob):
+        """
+        return a new queue that gets every raw (channel, message) published under
+        glob and None once the subscription ends
+        """
+
+        q = FastQueue()
+        async with self._sub_lock:
+            subscription = self._subscriptions.get(glob)
+            if subscription is None:
+                chan, = await self.aredis.psubscribe(glob)
+                subscription = (asyncio.create_task(self.fan_out(chan, glob)), set())
+                self._subscriptions[glob] = subscription
+            subscription[1].add(q)
+
+        return q
+
+    async def unsubscribe(self, glob, q):
+        """ drop q from glob's listeners.  the last one unsubscribes from redis """
+
+        async with self._sub_lock:
+            subscription = self._subscriptions.get(glob)
+            if subscription is None:
+                return
+            task, queues = subscription
+            queues.discard(q)
+            if queues:
+                return
+            del self._subscriptions[glob]
+
+            if self.aredis is not None and not self.aredis.closed:
+                # closes the channel which ends fan_out
+                await self.aredis.punsubscribe(glob)
+            else:
+                task.cancel()
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def fan_out(self, chan, glob):
+        """ copy each message on the glob's channel to every listener queue """
+
+        try:
+            async for message in chan.iter():
+                subscription = self._subscriptions.get(glob)
+                if subscription is None:
+                    break
+                for q in subscription[1]:
+                    q.put_nowait(message)
+        finally:
+            subscription = self._subscriptions.get(glob)
+            if subscription is not None and subscription[0] is asyncio.current_task():
+                for q in subscription[1]:
+                    q.put_nowait(None)
+
+    async def release(self):
+        """ drop a reference.  the last one closes the pool and tunnel """
+
+        async with self._lock:
+            self.refs -= 1
+            if self.refs:
+                return
+            del self._shared[self.key]
+
+        self.aredis.close()
+        await self.aredis.wait_closed()
+        self.aredis = None
+
+        # this is slow so run in the ssh thread pool
+        await asyncio.get_running_loop().run_in_executor(_SSH_EXECUTOR, self.tunnel.stop)
+        self.tunnel = None
+        logger.info(f"Redis connection closed")
+
+
 # todo: should this be initialized with a mask to restrict the namespace?
 # todo: using patterns makes many of the status metrics unavailable.  Should there just be a single channel?
 class RedisMessageBus(MessageBus):
@@ -155,23 +477,56 @@ class RedisMessageBus(MessageBus):
 
     def __init__(self, pattern):
         super().__init__()
-        self.tunnel = None
+        self.connection = None
         self.aredis = None
         self.pattern = pattern
+        self._redis_pattern = self.to_redis_pattern(pattern)
+        self._pending = None
+        self._flusher_task = None
 
     async def connect(self, tunnel_config):
-        def create_tunnel():
-            self.tunnel = SSHTunnelForwarder(**tunnel_config)
-            self.tunnel.start()
+        self.connection = await RedisConnection.acquire(tunnel_config)
+        self.aredis = self.connection.aredis
 
-        await asyncio.get_event_loop().run_in_executor(None, create_tunnel)
+        self._pending = asyncio.Queue()
+        self._flusher_task = asyncio.create_task(self.flusher())
 
-        address = self.tunnel.local_bind_address
-        self.aredis = await aioredis.create_redis_pool(address, encoding="utf-8")
-        logger.info(f"Redis connected: {self.aredis.address}")
+    async def flusher(self):
+        """ publish queued messages to redis in pipelined batches """
+
+        q = self._pending
+        while True:
+            batch = [await q.get()]
+            if REDIS_BATCH_WAIT:
+                await asyncio.sleep(REDIS_BATCH_WAIT)
+            while len(batch) < REDIS_BATCH_SIZE and not q.empty():
+                batch.append(q.get_nowait())
+
+            try:
+                pipe = self.aredis.pipeline()
+                for message in batch:
+                    pipe.publish(message.key, message.value)
+                await pipe.execute()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Redis flush: {len(batch)} messages dropped {type(e)} {e}")
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    @staticmethod
+    def to_redis_pattern(pattern):
+        """ redis glob for a dot pattern """
+
+        if pattern in ("", "."):
+            return "*"
+        return pattern + "*" if pattern.endswith('.') else pattern
 
-    def redis_pattern(self):
-        return self.pattern + "*" if self.pattern.endswith('.') else self.pattern
+    def redis_pattern(self, pattern=None):
+        """ redis glob for a dot pattern, defaulting to the bus's own pattern """
+
+        return self._redis_pattern if pattern is None else self.to_redis_pattern(pattern)
 
     async def send(self, message):
         if not self.aredis:
@@ -180,20 +535,34 @@ class RedisMessageBus(MessageBus):
         if message.key.endswith("."):
             raise ValueError("trailing '.' in key")
 
-        logger.info(f"Redis send: {message}:{message.value}")
-        await self.aredis.publish(message.key, message.value)
+        logger.info("Redis send: %s:%s", message, message.value)
+        await self._pending.put(message)
+
+    async def listen(self, pattern=None, encoding="utf-8"):
+        """
+        yield messages published under pattern.  pass encoding=None to receive raw
+        bytes values and skip the per-message decode
+        """
 
-    async def listen(self, pattern='*'):
         if not self.aredis:
             raise RuntimeError("Redis not connected")
 
+        # the connection owns the subscription and gives every listener its own
+        # copy of each raw (channel, message) pair
+        # held locally as close() drops self.connection before a lingering
+        # listener gets finalized
+        connection = self.connection
+        glob = self.redis_pattern(pattern)
+        q = await connection.subscribe(glob)
         try:
-            chan, = await self.aredis.psubscribe(self.redis_pattern())
-            while await chan.wait_message():
-                k, v = await chan.get(encoding="utf-8")
-                yield Message("redis", k.decode(), v)
-        except Exception:
-            raise
+            while True:
+                for item in await q.get_batch():
+                    if item is None:
+                        return
+                    k, v = item
+                    yield Message("redis", k.decode(), v.decode(encoding) if encoding else v)
+        finally:
+            await connection.unsubscribe(glob, q)
 
     async def status(self):
         if self.aredis:
@@ -207,40 +576,37 @@ class RedisMessageBus(MessageBus):
             return {"status": "disconnected"}
 
     async def close(self):
-        self.aredis.close()
-        await self.aredis.wait_closed()
-        self.aredis = None
+        # let the flusher drain whatever is still queued
+        await self._pending.join()
+        self._flusher_task.cancel()
+        self._flusher_task = None
 
-        # this is slow so run in a thread pool
-        await asyncio.get_event_loop().run_in_executor(None, self.tunnel.stop)
-        self.tunnel = None
-        logger.info(f"Redis connection closed")
+        self.aredis = None
+        await self.connection.release()
+        self.connection = None
 
 
 class RedisMessageBridge:
-    """ bridge a local MessageBus with an external Redis pubsub channel """
+    """
+    bridge a local MessageBus with a RedisMessageBus.  the bridge just relays
+    between the two; its redis listener shares the connection's subscription to
+    the glob with any other listener on it
+    """
 
-    def __init__(self, pattern, tunnel_config, bus):
+    def __init__(self, pattern, redis_bus, bus):
         self.bus = bus
-        self.aredis = None
+        self.redis_bus = redis_bus
         self.pattern = pattern
-        self.tunnel_config = tunnel_config
 
     async def receiver(self):
-        redis_pattern = self.pattern
-        if redis_pattern.endswith('.'):
-            redis_pattern += '*'
+        """ route redis messages to the local bus """
 
         try:
-            chan, = await self.aredis.psubscribe(redis_pattern)
-            while await chan.wait_message():
-                k, v = await chan.get(encoding="utf-8")
-                logger.info(f"bridge in {self.pattern}: message {k}: {v}")
-                await self.bus.send(Message("redis", k.decode(), v))
+            async for message in self.redis_bus.listen(self.pattern):
+                logger.info("bridge in %s: message %s: %s", self.pattern, message.key, message.value)
+                await self.bus.send(message)
         except asyncio.CancelledError:
             logger.info(f"bridge in {self.pattern}: cancelled")
-        finally:
-            await self.aredis.punsubscribe(redis_pattern)
 
     async def sender(self):
         """ route local messages to redis """
@@ -248,38 +614,31 @@ class RedisMessageBridge:
         try:
             async for message in self.bus.listen(self.pattern):
                 if message.source != "redis":
-                    logger.info(f"bridge out {self.pattern}: {message}")
-                    await self.aredis.publish(message.key, message.value)
+                    logger.info("bridge out %s: %s", self.pattern, message)
+                    await self.redis_bus.send(message)
         except asyncio.CancelledError:
             logger.info(f"bridge out {self.pattern}: cancelled")
 
     async def start(self):
-        """ open tunnel to redis server and start sender/receiver tasks """
-
-        with SSHTunnelForwarder(**self.tunnel_config) as tunnel:
-            address = tunnel.local_bind_address
-            self.aredis = await aioredis.create_redis_pool(address, encoding="utf-8")
-            logger.info(f"bridge connected: {self.aredis.address}")
+        """ start sender/receiver tasks """
 
-            try:
-                await asyncio.gather(
-                    self.receiver(),
-                    self.sender(),
-                )
-            except asyncio.CancelledError:
-                logger.info(f"bridge start {self.pattern}: cancelled")
-            except Exception as e:
-                logger.info(f'bridge start {self.pattern}: exception {e} {type(e)}')
-
-            self.aredis.close()
-            await self.aredis.wait_closed()
+        try:
+            await asyncio.gather(
+                self.receiver(),
+                self.sender(),
+            )
+        except asyncio.CancelledError:
+            logger.info(f"bridge start {self.pattern}: cancelled")
+        except Exception as e:
+            logger.info(f'bridge start {self.pattern}: exception {e} {type(e)}')
 
 
 class YamahaComponent:
     """ bridge Yamaha YNCA component onto MessageBus """
 
-    def __init__(self, ynca_hostname, bus):
+    def __init__(self, ynca_hostname, bus, pattern="yamaha."):
         self.bus = bus
+        self.pattern = pattern
         self.yamaha = Yamaha(ynca_hostname)
 
         # start up the listener
@@ -288,7 +647,7 @@ class YamahaComponent:
     async def listen(self):
         """ listen for commands and relay them to the component """
         try:
-            async for message in self.bus.listen():
+            async for message in self.bus.listen(self.pattern):
                 print(f"yamaha:", message)
         except asyncio.CancelledError:
             pass
@@ -297,6 +656,7 @@ class YamahaComponent:
         """ Shut down the listener """
         self.listen_task.cancel()
         self.listen_task = None
+        await self.yamaha.close()
 
         logger.info(f"yamaha: closed")
 
@@ -312,11 +672,16 @@ async def main():
                 await asyncio.sleep(0.35)
                 await bus.send(Message("local", k, v))
 
-    async def listen(bus, pattern):
+    async def listen(bus, patterns):
+        """ a single bus subscription dispatched locally to each pattern """
+
         await asyncio.sleep(1.5)
+        matchers = [DotPattern(p) for p in patterns]
         try:
-            async for message in bus.listen(pattern):
-                print(f"listen({pattern}):", message)
+            async for message in bus.listen("."):
+                for p in matchers:
+                    if p.match(message.key):
+                        print(f"listen({p}):", message)
         except asyncio.CancelledError:
             pass
 
@@ -347,9 +712,7 @@ async def main():
 
     tasks = [asyncio.create_task(c) for c in (
         talk(ps, ("cat.dog", "cat.pig", "cow.emu")),
-        listen(ps, "."),
-        listen(ps, "cat."),
-        listen(ps, "cat.pig"),
+        listen(ps, (".", "cat.", "cat.pig")),
         monitor(),
     )]
 
@@ -366,7 +729,7 @@ if __name__ == "__main__":
     handler = logging.StreamHandler()
     try:
         logger.addHandler(handler)
-        asyncio.run(main(), debug=True)
+        asyncio.run(main(), debug=False)
     finally:
         logger.removeHandler(handler)
     print("all: done")
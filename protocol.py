@@ -1,29 +1,29 @@
 import sys
 import asyncio
-import yamaha
-import patch
+import logging
+from aiotools import patch
+from ynca import ynca_frame, decode_response, set_nodelay
 
 
 class YNCAProtocol(asyncio.Protocol):
-    def __init__(self, name, value, on_con_lost, loop=None):
-        self.message = name + "=" + value + "\r\n"
-        self.loop = loop
-        self.data = ""
+    def __init__(self, name, value, on_con_lost):
+        self.message = ynca_frame(name, value)
+        self.data = bytearray()
         self.on_con_lost = on_con_lost
 
     def connection_made(self, transport):
-        transport.write(self.message.encode())
-        print('Data sent: {!r}'.format(self.message))
+        set_nodelay(transport)
+        transport.write(self.message)
+        logging.debug("data sent: %r", self.message)
 
     def data_received(self, data):
-        print('Data received: {!r}'.format(data.decode()))
-        self.data += data.decode()
+        logging.debug("data received: %r", data)
+        self.data += data
 
     def connection_lost(self, exc):
-        print('The server closed the connection')
+        logging.debug("the server closed the connection")
         if not self.on_con_lost.cancelled():
-            response = yamaha.decode_response(self.data)
-            print("future done:", self.on_con_lost.done(), "cancelled:", self.on_con_lost.cancelled())
+            response = decode_response(bytes(self.data))
             self.on_con_lost.set_result(response)
 
 
@@ -42,69 +42,86 @@ class Yamaha:
         loop = asyncio.get_running_loop()
 
         done = loop.create_future()
+        timed_out = False
+
+        def expire():
+            nonlocal timed_out
+            timed_out = True
+            done.cancel()
+
+        # time out by cancelling the future we wait on rather than wrapping the
+        # whole request in wait_for.  cancelling the task cancels done too so
+        # the flag is what tells a timeout apart
+        timer = loop.call_at(loop.time() + timeout, expire) if timeout is not None else None
         try:
             transport, protocol = await loop.create_connection(
                 lambda: YNCAProtocol(name, value, done),
                 hostname, 50000)
         except Exception as e:
-            print("create conn:", e)
-            
+            logging.warning("create conn: %s", e)
+            if timer:
+                timer.cancel()
+
             return
 
-        print("connect:")
         # Wait until the protocol signals that the connection
         # is lost and close the transport.
         
         try:
-            print("awaiting done")
-            await done
-            print("done:", done.result())
+            result = await done
         except asyncio.CancelledError:
-            print("request cancelled")
+            if not timed_out:
+                raise
+            logging.info("request timeout(%s): %s %s", timeout, name, value)
+            return
         finally:
-            print('finally close:')
+            if timer:
+                timer.cancel()
             transport.close()
 
-        print("done result:", done.result())
-        return done.result()
+        logging.debug("request %d result %r", self.request_id, result)
+        return result
 
     async def get(self, name, timeout=0.05):
         """ send request to get value """
-        try:
-            x = await asyncio.wait_for(self.request(self.hostname, name, '?'),
-                                       timeout=timeout)
-            print("request:", x)
-            return x
-        except asyncio.TimeoutError as e:
-            print('timeout:', e)
-            return None
+        return await self.request(self.hostname, name, '?', timeout)
 
     async def put(self, name, value, timeout=0.05):
         """ send request.  use timeout of 0 to skip waiting for response """
-        try:
-            x = await asyncio.wait_for(self.request(self.hostname, name, value),
-                                       timeout=timeout)
-            print("request:", x)
-            return x
-        except asyncio.TimeoutError as e:
-            print('timeout:', e)
+        if timeout == 0:
+            # fire and forget.  no protocol, future or timer needed
+            try:
+                _, writer = await asyncio.open_connection(self.hostname, 50000)
+            except Exception as e:
+                logging.warning("create conn: %s", e)
+                return
+
+            writer.write(ynca_frame(name, value))
+            writer.close()
+            await writer.wait_closed()
+            return
+
+        x = await self.request(self.hostname, name, value, timeout)
+        if x is None and timeout:
             # Protocol won't answer if we try to PUT value to a name that
             # is already set to the same value.  if we indicated a timeout and
             # no response was received then get and return the current value
-            return self.get(name, timeout * 2.0)
+            return await self.get(name, timeout * 2.0)
+
+        return x
 
 
 async def main():
     # Get a reference to the event loop as we plan to use
     # low-level APIs.
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
 
     on_con_lost = loop.create_future()
 
     name, value = "@MAIN:PWR", "On"
 
     transport, protocol = await loop.create_connection(
-        lambda: YNCAProtocol(name, value, on_con_lost, loop),
+        lambda: YNCAProtocol(name, value, on_con_lost),
         'CL-6EA47', 50000)
 
     # Wait until the protocol signals that the connection
@@ -116,9 +133,7 @@ async def main():
 
 
 def run(future):
-    loop = asyncio.get_event_loop()
-
-    result = loop.run_until_complete(future)
+    result = asyncio.run(future)
     print("result:", result)
 
 
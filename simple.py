@@ -5,15 +5,12 @@ simple demo with a yamaha target on a simple message bus
 """
 
 import os
-import re
-import time
 import logging
 import asyncio
-import aioredis
 from collections import namedtuple
-from sshtunnel import SSHTunnelForwarder
 
-from aiotools import patch
+from aiotools import patch, wait_gracefully
+from poc import DotPattern, RedisConnection, ts
 from yamaha import Yamaha
 
 Message = namedtuple("Message", "key, value")
@@ -21,34 +18,6 @@ Message = namedtuple("Message", "key, value")
 logger = logging.getLogger()
 
 
-def ts():
-    return time.time()
-
-
-class RegexPattern:
-    """ regex patterns """
-
-    def __init__(self, pattern):
-        self.regex = re.compile(pattern)
-
-    def match(self, subject):
-        return self.regex.fullmatch(subject)
-
-
-class DotPattern:
-    """ dot-separated path-style patterns """
-
-    def __init__(self, pattern):
-        self.pattern = pattern.upper()
-
-    def match(self, subject):
-        if self.pattern == subject.upper() or self.pattern in ("", "."):
-            return True
-
-        prefix = self.pattern + "" if self.pattern[-1] == "." else "."
-        return subject.upper().startswith(prefix)
-
-
 class MessageBus:
     def __init__(self):
         self._channels = {}
@@ -66,7 +35,7 @@ class BasicMessageBus(MessageBus):
     def __init__(self):
         super().__init__()
         self.conn = None
-        self.listeners = set()
+        self.listeners = {}
 
     async def connect(self, address=None):
         self.conn = self
@@ -79,9 +48,12 @@ class BasicMessageBus(MessageBus):
         if k.endswith("."):
             raise ValueError("trailing '.' in key")
         self.set_channel(k, v)
-        for pattern, q in self.listeners:
+
+        # listener queues are unbounded so fan out in one pass without yielding
+        message = Message(k, v)
+        for pattern, q in self.listeners.values():
             if pattern.match(k):
-                await q.put(Message(k, v))
+                q.put_nowait(message)
 
     async def listen(self, pattern):
         if not self.conn:
@@ -91,7 +63,7 @@ class BasicMessageBus(MessageBus):
             p = DotPattern(pattern)
             q = asyncio.Queue()
 
-            self.listeners.add((p, q))
+            self.listeners[id(q)] = (p, q)
 
             # yield current values
             for k, v in self.get_channels():
@@ -107,7 +79,7 @@ class BasicMessageBus(MessageBus):
         except:
             raise
         finally:
-            self.listeners.remove((p, q))
+            self.listeners.pop(id(q), None)
 
     async def status(self):
         if self.conn:
@@ -122,8 +94,8 @@ class BasicMessageBus(MessageBus):
 
     async def close(self):
         self.conn = None
-        for p, q in self.listeners:
-            await q.put(None)
+        for p, q in self.listeners.values():
+            q.put_nowait(None)
         logger.info(f"connection closed")
 
 
@@ -184,58 +156,53 @@ async def main():
             "ssh_pkey": os.path.expanduser(r"~/.ssh/id_rsa"),
         }
 
-        with SSHTunnelForwarder(**tunnel_config) as tunnel:
-            address = tunnel.local_bind_address
-            print("redis connecting", address)
-            aredis = await aioredis.create_redis(address, encoding="utf-8")
-
-            print("redis connected", aredis.address)
-
-            try:
-                chan, = await aredis.psubscribe(pattern)
-                while await chan.wait_message():
-                    k, v = await chan.get(encoding="utf-8")
-                    await bus.send(k.decode(), v)
-
-                print("watch: done")
-            except asyncio.CancelledError:
-                print("watch cancelled:", pattern)
-            except Exception as e:
-                print("exception:", type(e), e)
-            finally:
-                print("watch finally")
+        connection = await RedisConnection.acquire(tunnel_config)
+        q = None
+        try:
+            print("redis connected", connection.aredis.address)
+
+            # subscribe through the shared connection so other holders of the glob
+            # keep their subscription when this one goes away
+            q = await connection.subscribe(pattern)
+            done = False
+            while not done:
+                for message in await q.get_batch():
+                    # None once the subscription ends
+                    if message is None:
+                        done = True
+                        break
+                    k, v = message
+                    await bus.send(k.decode(), v.decode())
+
+            print("watch: done")
+        except asyncio.CancelledError:
+            print("watch cancelled:", pattern)
+        except Exception as e:
+            print("exception:", type(e), e)
+        finally:
+            print("watch finally")
 
-                aredis.close()
-                await aredis.wait_closed()
+            if q is not None:
+                await connection.unsubscribe(pattern, q)
+            await connection.release()
 
         print("watch done:", pattern)
 
-    aws = {
+    tasks = [asyncio.create_task(c) for c in (
         talk(("cat.dog", "cat.pig", "cow.emu")),
         listen("."),
         listen("cat."),
         listen("cat.pig"),
         bridge("cat.*", ps),
         mon(),
-    }
-    done, pending = await asyncio.wait(aws, timeout=15)
-
-    print("run done:", len(done), "pending:", len(pending))
-    for t in pending:
-        print("cancelling:")
-        t.cancel()
-        # result = await t
-        # print('cancel:', result)
-
-    for t in done:
-        if t.exception():
-            print("exception:", t, t.exception())
-        else:
-            print("result:", t.result())
+    )]
+
+    await wait_gracefully(tasks, timeout=15)
 
     print("main: done")
 
 
 if __name__ == "__main__":
-    asyncio.run(main(), debug=True)
+    patch()
+    asyncio.run(main(), debug=False)
     print("all: done")
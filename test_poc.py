@@ -0,0 +1,77 @@
+""" tests for the message bus building blocks """
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("aioredis")
+pytest.importorskip("sshtunnel")
+
+from poc import FastQueue, ListenerTrie
+
+
+def test_trie_match():
+    trie = ListenerTrie()
+    trie.add("yamaha.", "prefix")
+    trie.add("yamaha.main.pwr", "exact")
+    trie.add("", "all")
+
+    assert sorted(trie.match("YAMAHA.MAIN.PWR")) == ["all", "exact", "prefix"]
+    assert sorted(trie.match("YAMAHA.MAIN.VOL")) == ["all", "prefix"]
+    assert trie.match("HUE.LIGHT") == ["all"]
+
+
+def test_trie_remove_prunes():
+    trie = ListenerTrie()
+    trie.add("yamaha.main.pwr", "q")
+    trie.add("yamaha.", "p")
+
+    trie.remove("yamaha.main.pwr", "q")
+    assert "MAIN" not in trie.root.children["YAMAHA"].children
+    assert trie.match("YAMAHA.MAIN.PWR") == ["p"]
+
+    trie.remove("yamaha.", "p")
+    assert not trie.root.children
+
+
+def test_trie_remove_keeps_values():
+    trie = ListenerTrie()
+    trie.set_value("yamaha.main.pwr", "On")
+    trie.add("yamaha.main.pwr", "q")
+
+    trie.remove("yamaha.main.pwr", "q")
+    assert trie.values("yamaha.main.pwr") == [("yamaha.main.pwr", "On")]
+
+
+def test_trie_values_order():
+    trie = ListenerTrie()
+    trie.set_value("yamaha.main.pwr", "On")
+    trie.set_value("yamaha.main.vol", "-40.0")
+    trie.set_value("yamaha.zone2.pwr", "Standby")
+    trie.set_value("hue.light", "off")
+
+    assert trie.values("yamaha.") == [
+        ("yamaha.main.pwr", "On"),
+        ("yamaha.main.vol", "-40.0"),
+        ("yamaha.zone2.pwr", "Standby"),
+    ]
+    assert trie.values("YAMAHA.MAIN.VOL") == [("yamaha.main.vol", "-40.0")]
+    assert trie.values("") == trie.values("yamaha.") + [("hue.light", "off")]
+    assert trie.values("sonos.") == []
+
+
+def test_fast_queue():
+    async def test():
+        q = FastQueue()
+        q.put_nowait(1)
+        q.put_nowait(2)
+        assert list(await q.get_batch()) == [1, 2]
+
+        getter = asyncio.ensure_future(q.get_batch())
+        await asyncio.sleep(0)
+        assert not getter.done()
+
+        q.put_nowait(3)
+        assert list(await getter) == [3]
+
+    asyncio.run(test())
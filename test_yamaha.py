@@ -0,0 +1,158 @@
+""" tests for the Yamaha client against the YNCAServer mock """
+
+import asyncio
+import time
+
+from yamaha import Yamaha, YNCAServer
+
+
+def run(test):
+    """ run test(yam, server) with a fresh mock receiver and client """
+
+    async def main():
+        server = YNCAServer().start()
+        await server.ready.wait()
+        yam = Yamaha('127.0.0.1')
+        try:
+            await test(yam, server)
+        finally:
+            await yam.close()
+            await server.wait_close()
+
+    asyncio.run(main())
+
+
+def test_get_put():
+    async def test(yam, server):
+        assert (await yam.get('@MAIN:PWR'))['@MAIN:PWR'] == 'Standby'
+        assert (await yam.put('@MAIN:PWR', 'On'))['@MAIN:PWR'] == 'On'
+        assert server.state['@MAIN:PWR'] == 'On'
+
+    run(test)
+
+
+def test_get_unknown_name_is_quick():
+    async def test(yam, server):
+        start = time.monotonic()
+        assert (await yam.get('@MAIN:FOO', timeout=0.5))['response'] == '@ERROR'
+        assert time.monotonic() - start < 0.2
+
+    run(test)
+
+
+def test_put_short_circuit():
+    async def test(yam, server):
+        await yam.put('@MAIN:PWR', 'On')
+        sent = len(server.log)
+
+        response = await yam.put('@MAIN:PWR', 'On')
+        assert response['@MAIN:PWR'] == 'On'
+        assert 'request_id' in response
+        assert len(server.log) == sent
+
+    run(test)
+
+
+def test_put_short_circuit_expires():
+    async def test(yam, server):
+        await yam.put('@MAIN:PWR', 'On')
+        yam.set_ttl(0)
+        sent = len(server.log)
+
+        # the receiver stays quiet so put confirms with a get
+        assert (await yam.put('@MAIN:PWR', 'On'))['@MAIN:PWR'] == 'On'
+        assert len(server.log) == sent + 2
+
+    run(test)
+
+
+def test_put_after_unsolicited_update():
+    async def test(yam, server):
+        await yam.put('@MAIN:PWR', 'On')
+
+        # the front panel puts it back in standby and the receiver says so
+        server.state['@MAIN:PWR'] = 'Standby'
+        yam._protocol.data_received(b'@MAIN:PWR=Standby\r\n')
+
+        assert (await yam.get('@MAIN:PWR'))['@MAIN:PWR'] == 'Standby'
+        assert (await yam.put('@MAIN:PWR', 'On'))['@MAIN:PWR'] == 'On'
+        assert server.state['@MAIN:PWR'] == 'On'
+
+    run(test)
+
+
+def test_partial_line_stays_buffered():
+    async def test(yam, server):
+        await yam.get('@MAIN:PWR')
+        yam._protocol.data_received(b'@MAIN:PWR=On\r\n@MAIN:VOL=-3')
+
+        yam.drain()
+        assert yam._shadow['@MAIN:PWR'][0] == 'On'
+        assert '@MAIN:VOL' not in yam._shadow
+        assert bytes(yam._protocol.buffer) == b'@MAIN:VOL=-3'
+
+    run(test)
+
+
+def test_get_ttl():
+    async def test(yam, server):
+        await yam.get('@MAIN:VOL')
+        sent = len(server.log)
+
+        await yam.get('@MAIN:VOL')
+        assert len(server.log) == sent
+
+        yam.set_ttl(0)
+        await yam.get('@MAIN:VOL')
+        assert len(server.log) == sent + 1
+
+    run(test)
+
+
+def test_coalesced_gets():
+    async def test(yam, server):
+        responses = await asyncio.gather(*(yam.get('@MAIN:VOL') for _ in range(5)))
+
+        assert len(server.log) == 1
+        assert all(r['@MAIN:VOL'] == '-40.0' for r in responses)
+        # every caller has a copy of its own
+        responses[0]['@MAIN:VOL'] = 'spoiled'
+        assert responses[1]['@MAIN:VOL'] == '-40.0'
+
+    run(test)
+
+
+def test_batch():
+    async def test(yam, server):
+        responses = await yam.batch([('@MAIN:PWR', 'On'), ('@MAIN:VOL', '?'), ('@MAIN:FOO', '?')], 0.5)
+
+        assert responses[0]['@MAIN:PWR'] == 'On'
+        assert responses[1]['@MAIN:VOL'] == '-40.0'
+        assert responses[2] is None
+
+    run(test)
+
+
+def test_multi_get():
+    async def test(yam, server):
+        start = time.monotonic()
+        responses = await yam.multi_get(['@MAIN:PWR', '@MAIN:AVAIL', '@MAIN:FOO'], 0.5)
+
+        assert responses['@MAIN:PWR']['@MAIN:PWR'] == 'Standby'
+        assert responses['@MAIN:AVAIL']['@MAIN:AVAIL'] == 'Not Ready'
+        assert responses['@MAIN:FOO'] is None
+        assert time.monotonic() - start < 0.2
+
+    run(test)
+
+
+def test_put_timeout_zero():
+    async def test(yam, server):
+        assert await yam.put('@MAIN:VOL', '-30.0', 0) is None
+        await asyncio.sleep(0.05)
+        assert server.state['@MAIN:VOL'] == '-30.0'
+
+        # the reply went to the throwaway connection, not this request
+        assert await yam.get('@MAIN:AVAIL') == {'@MAIN:AVAIL': 'Not Ready', 'response': '@OK', 'request_id': 1}
+
+    run(test)
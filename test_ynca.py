@@ -0,0 +1,18 @@
+""" tests for the shared YNCA response parser """
+
+from ynca import decode_response
+
+
+def test_decode_lines():
+    response = decode_response(b'@MAIN:PWR=Standby\r\n@MAIN:AVAIL=Not Ready\r\n')
+
+    assert response == {'@MAIN:PWR': 'Standby', '@MAIN:AVAIL': 'Not Ready', 'response': '@OK'}
+
+
+def test_decode_error():
+    assert decode_response(b'@UNDEFINED') == {'response': '@ERROR'}
+    assert decode_response(b'@RESTRICTED\r\n') == {'response': '@ERROR'}
+
+
+def test_decode_empty():
+    assert decode_response(b'') == {'response': '@OK'}
@@ -16,12 +16,13 @@ samples:
     print("vol good", yam.put("@MAIN:VOL", 'Down 2 dB', timeout))
 """
 
-import re
 import sys
 import asyncio
 import logging
+from collections import OrderedDict
 
 import aiotools
+from ynca import YNCA_ERRORS, ynca_frame, decode_response, set_nodelay
 
 
 """
@@ -32,6 +33,79 @@ todo: write a dummy server task to mock the endpoint for testing
 """
 
 
+# once a response has complete lines, how long (sec) to wait for more before
+# treating it as finished
+YNCA_IDLE = 0.01
+
+# most names to remember the last value of
+YNCA_SHADOW_SIZE = 512
+
+# how long (sec) get trusts the last reported value before asking again
+YNCA_TTL = 1.0
+
+
+class YNCAClientProtocol(asyncio.Protocol):
+    """ persistent YNCA connection.  buffers whatever the receiver sends and wakes the waiting request """
+
+    def __init__(self):
+        self.transport = None
+        self.buffer = bytearray()
+        self.closed = False
+        self._waiter = None
+        self._lost = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        set_nodelay(transport)
+
+    def data_received(self, data):
+        self.buffer += data
+        self._wake()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if not self._lost.done():
+            self._lost.set_result(None)
+        self._wake()
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def wait(self, timeout):
+        """ wait for more data or the connection to close.  False on timeout """
+
+        if self.closed:
+            return True
+
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+    async def wait_closed(self):
+        await self._lost
+
+    def take(self):
+        """ remove and return everything buffered """
+
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return data
+
+    def take_lines(self):
+        """ remove and return the complete lines buffered leaving any partial one """
+
+        end = self.buffer.rfind(b'\r\n')
+        end = end + 2 if end >= 0 else 0
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+
 class Yamaha:
     """ Yamaha YNCA controller """
 
@@ -40,64 +114,186 @@ class Yamaha:
         self.hostname = hostname
         self.request_id = 0
         self.timeout = 0.05
-        
+        self.ttl = YNCA_TTL
+        self._protocol = None
+        self._address = None
+        self._lock = None
+        # last known (value, loop time) of each name as reported by the receiver
+        self._shadow = OrderedDict()
+        # gets on their way to the receiver by name
+        self._inflight = {}
+
     def set_timeout(self, timeout):
         self.timeout = timeout
 
-    @staticmethod
-    def decode_response(data):
-        """ Convert response to a dict """
-    
-        response = data.rstrip('\r\n')
-    
-        # decode data and check if response indicates error
-        results = {}
-        if response in ("@UNDEFINED", '@RESTRICTED', '@ERROR'):
-            results = {'response': '@ERROR'}
-        else:
-            exp = re.compile(r"(.*)=(.*)\s*", re.IGNORECASE)
-            for line in response.split("\r\n"):
-                if line:
-                    m = exp.match(line)
-                    results[m.group(1)] = m.group(2)
-            results['response'] = '@OK'
-    
-        return results
+    def set_ttl(self, ttl):
+        self.ttl = ttl
 
-    async def ynca_request(self, address, message, timeout=1):
-        if type(address) == str:
-            reader, writer = await asyncio.open_connection(address, 50000)
+    def invalidate(self, name=None):
+        """ forget the last known value of name, or of everything, e.g. after the remote was used """
+
+        if name is None:
+            self._shadow.clear()
         else:
-            reader, writer = await asyncio.open_connection(*address)
+            self._shadow.pop(name, None)
+
+    def remember(self, results):
+        """
+        note whatever the receiver reported in the shadow, asked for or not.  least
+        recently reported names go first once there are too many
+        """
+
+        shadow = self._shadow
+        now = asyncio.get_running_loop().time()
+        for name, value in results.items():
+            if name != 'response':
+                shadow[name] = (value, now)
+                shadow.move_to_end(name)
+        while len(shadow) > YNCA_SHADOW_SIZE:
+            shadow.popitem(last=False)
+
+    def drain(self):
+        """
+        fold complete lines the receiver sent between requests into the shadow.
+        they're still news of what it's up to, e.g. the remote was used.  a
+        partial line is the start of what comes next so it stays buffered
+        """
+
+        protocol = self._protocol
+        if protocol:
+            stale = protocol.take_lines()
+            if stale:
+                self.remember(self.decode_response(stale))
+
+    def known(self, name):
+        """
+        the last value reported for name if it's within ttl, otherwise None.  None
+        too while a request is out since its reply may well change things
+        """
+
+        if self._lock is not None and self._lock.locked():
+            return None
+
+        self.drain()
+        known = self._shadow.get(name)
+        if known and asyncio.get_running_loop().time() - known[1] < self.ttl:
+            return known[0]
+
+    decode_response = staticmethod(decode_response)
+
+    async def connect(self, address):
+        """
+        open the persistent connection to address unless it's already open.  returns
+        True if an existing connection is being reused
+        """
+
+        if isinstance(address, str):
+            address = (address, self.port)
+
+        if self._protocol and not self._protocol.closed and self._address == address:
+            return True
+
+        await self.close()
+
+        loop = asyncio.get_running_loop()
+        _, self._protocol = await loop.create_connection(YNCAClientProtocol, *address)
+        self._address = address
+
+        return False
+
+    async def close(self):
+        """ close the persistent connection and wait for it to shut down """
+
+        protocol, self._protocol, self._address = self._protocol, None, None
+        if protocol:
+            protocol.transport.close()
+            await protocol.wait_closed()
 
-        self.request_id += 1
+    @staticmethod
+    def replied(data, names):
+        """
+        True once data answers every one of names (bytes).  an error line is the
+        answer to a name that won't be getting a NAME= line
+        """
+
+        if not names:
+            return True
+
+        seen = set()
+        errors = 0
+        for line in bytes(data).split(b'\r\n'):
+            if line in YNCA_ERRORS:
+                errors += 1
+            else:
+                seen.add(line.partition(b'=')[0])
+
+        return len(names & seen) + errors >= len(names)
+
+    async def exchange(self, message, timeout, expect=frozenset()):
+        """
+        write message on the open connection and collect the raw response until the
+        receiver goes quiet.  the names in expect all have to turn up before going
+        quiet counts.  None if the connection was closed before any response
+        """
+
+        protocol = self._protocol
+
+        # whatever arrived between requests isn't a response to this one
+        self.drain()
+        protocol.transport.write(message)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not protocol.closed:
+            if protocol.buffer.endswith(b'\r\n') and self.replied(protocol.buffer, expect):
+                # have complete lines.  only linger briefly in case more follow
+                wait = min(YNCA_IDLE, timeout)
+            else:
+                wait = max(0, deadline - loop.time())
+
+            if not await protocol.wait(wait):
+                break
 
-        # ensure the message is properly terminated
-        if not message.endswith('\r\n'):
-            message += '\r\n'
+        response = protocol.take()
+
+        if protocol.closed:
+            logging.info("ynca_request connection closed %r %r", self._address, message)
+            await self.close()
+            return response or None
+
+        if not response:
+            logging.info("ynca_request timeout(%s): %r %r", timeout, self._address, message)
+
+        return response
+
+    async def ynca_request(self, address, message, timeout=1, expect=frozenset()):
+        # ensure the message is properly terminated and encoded
+        if isinstance(message, str):
+            if not message.endswith('\r\n'):
+                message += '\r\n'
+            message = message.encode()
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # requests share one connection so they go one at a time
+        async with self._lock:
+            self.request_id += 1
+
+            reused = await self.connect(address)
+            response = await self.exchange(message, timeout, expect)
+            if response is None and reused:
+                # the receiver dropped the idle connection.  reconnect and resend once
+                await self.connect(address)
+                response = await self.exchange(message, timeout, expect)
+
+        logging.debug("raw response %r", response)
+
+        results = self.decode_response(response or b'')
+        self.remember(results)
+
+        results['request_id'] = self.request_id
 
-        writer.write(message.encode())
-    
-        response = []
-        while True:
-            try:
-                data = await asyncio.wait_for(reader.readuntil(b'\r\n'), timeout=timeout)
-                response.append(data.decode())
-            except asyncio.IncompleteReadError as e:
-                logging.info(f"ynca_request incomplete read {e}) {address!r} {message!r}")
-                break
-            except asyncio.TimeoutError:
-                if not response:
-                    logging.info(f"ynca_request timeout({timeout}): {address!r} {message!r}")
-                break
-    
-        writer.close()
-    
-        logging.debug(f"raw response {response!r}")
-    
-        results = self.decode_response(''.join(response))
-        results['request_id'] = str(self.request_id)
-        
         return results
 
     async def request(self, hostname, name, value, timeout=None):
@@ -105,67 +301,150 @@ class Yamaha:
         return a response """
 
         try:
-            message = name + "=" + value + "\r\n"
-            response = await self.ynca_request((hostname, 50000), message,
-                                               timeout or self.timeout)
+            message = ynca_frame(name, value)
+            # a query always gets an answer.  a put may not
+            expect = frozenset((name.encode(),)) if value == '?' else frozenset()
+            response = await self.ynca_request((hostname, self.port), message,
+                                               timeout or self.timeout, expect)
         except Exception as e:
-            logging.warning(f"ynca exception: {type(e)} {e}")
+            logging.warning("ynca exception: %s %s", type(e), e)
+            self.invalidate(name)
             return
         else:
+            if response['response'] == '@ERROR':
+                self.invalidate(name)
             return response
 
     async def get(self, name, timeout=None):
-        """ send request to get value of name """
+        """ send request to get value of name.  answered locally if it was reported within ttl """
+
+        known = self.known(name)
+        if known is not None:
+            return {name: known, 'response': '@OK', 'request_id': self.request_id}
 
-        return await self.request(self.hostname, name, '?',
-                                  timeout=timeout or self.timeout)
+        # share a get that's already on its way rather than asking again
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self.request(self.hostname, name, '?',
+                                                      timeout=timeout or self.timeout))
+            self._inflight[name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+
+        # one caller giving up shouldn't cancel it for the others.  each gets its
+        # own copy of the result so none can spoil it for the rest
+        response = await asyncio.shield(task)
+        return dict(response) if response else response
 
     async def put(self, name, value, timeout=None):
         """ send request to set name to value.  A timeout of 0 skips wait for response """
 
+        if self.known(name) == value:
+            # already set.  the receiver wouldn't answer anyway
+            return {name: value, 'response': '@OK', 'request_id': self.request_id}
+
+        if timeout == 0:
+            # fire and forget on a connection of its own so the reply can't turn
+            # up in the middle of someone else's request on the shared one
+            self.invalidate(name)
+            try:
+                _, writer = await asyncio.open_connection(self.hostname, self.port)
+            except Exception as e:
+                logging.warning("ynca exception: %s %s", type(e), e)
+                return
+
+            writer.write(ynca_frame(name, value))
+            writer.close()
+            await writer.wait_closed()
+            return
+
         timeout = timeout or self.timeout
-        
+
         x = await self.request(self.hostname, name, value, timeout=timeout)
-        if not x and timeout:
+        if x and name not in x and x['response'] != '@ERROR':
             # Protocol won't answer if we try to PUT value to a name that
-            # is already set to the same value.  if we indicated a timeout and
-            # no response was received then get and return the current value
+            # is already set to the same value.  if the reply didn't mention
+            # the name then get and return the current value.  whatever the
+            # shadow holds is stale so make sure the get goes to the receiver
+            self.invalidate(name)
             return await self.get(name, timeout * 2.0)
 
         return x
 
+    async def multi_get(self, names, timeout=None):
+        """ get several names at once.  returns a dict of name to response """
+
+        responses = await self.batch([(name, '?') for name in names], timeout)
+        return dict(zip(names, responses))
+
+    async def batch(self, requests, timeout=None):
+        """
+        send several (name, value) requests back to back on the connection and collect
+        the replies together.  returns a list aligned with requests holding the reply
+        for each name or None if there wasn't one
+        """
+
+        message = b''.join(ynca_frame(name, value) for name, value in requests)
+        # wait for an answer to every query, not just the first line back
+        expect = frozenset(name.encode() for name, value in requests if value == '?')
+        try:
+            response = await self.ynca_request((self.hostname, self.port), message,
+                                               timeout or self.timeout, expect)
+        except Exception as e:
+            logging.warning("ynca exception: %s %s", type(e), e)
+            for name, _ in requests:
+                self.invalidate(name)
+            return [None] * len(requests)
+
+        return [{name: response[name], 'response': '@OK'} if name in response else None
+                for name, _ in requests]
+
 
 class YNCAServer:
     """ Mock YNCA host """
 
     def __init__(self):
         self.server = None
+        self.ready = None
         self.log = []
+        self.state = {"@MAIN:PWR": "Standby", "@MAIN:AVAIL": "Not Ready", "@MAIN:VOL": "-40.0"}
 
     def start(self):
-        # todo: implement multiple requests in a single connection
         async def handle_request(reader, writer):
+            addr = writer.get_extra_info('peername')
             try:
-                data = await reader.read(100)
-                message = data.decode()
-                addr = writer.get_extra_info('peername')
-    
-                logging.info(f"handle_request: received {message!r} from {addr!r}")
-        
-                response = b'@MAIN:PWR=Standby\r\n@MAIN:AVAIL=Not Ready\r\n'
-                writer.write(response)
-                await writer.drain()
-    
-                self.log.append((message, response))
-    
-                # there could be more to process but punt on that for now
-                await asyncio.sleep(2)
-    
-                logging.info("handle: close request connection")
+                # serve requests on the one connection until the client hangs up
+                while True:
+                    try:
+                        line = await reader.readuntil(b'\r\n')
+                    except asyncio.IncompleteReadError:
+                        break
+
+                    message = line.decode()
+                    logging.debug("handle_request: received %r from %r", message, addr)
+
+                    name, _, value = message.rstrip('\r\n').partition('=')
+                    if name not in self.state:
+                        response = b'@UNDEFINED\r\n'
+                    elif value == '?':
+                        response = ynca_frame(name, self.state[name])
+                    elif value != self.state[name]:
+                        self.state[name] = value
+                        response = ynca_frame(name, value)
+                    else:
+                        # like the real thing, stay quiet when nothing changes
+                        response = b''
+
+                    if response:
+                        writer.write(response)
+                        await writer.drain()
+
+                    self.log.append((message, response))
+
+                logging.debug("handle: close request connection")
                 writer.close()
-    
+
             except OSError as e:
-                logging.info('server: error start', e)
+                logging.info('server: error start %s', e)
                 return
 
         async def boot():
@@ -177,7 +456,11 @@ class YNCAServer:
                 logging.warning(f"server: error start {e}")
             except asyncio.CancelledError as e:
                 logging.warning(f"server: cancel exception: {type(e)}")
-    
+            finally:
+                # listening or not, anyone waiting on start can go ahead
+                self.ready.set()
+
+        self.ready = asyncio.Event()
         asyncio.create_task(boot())
 
         return self
@@ -196,24 +479,21 @@ class YNCAServer:
        
 async def main():
     async def test(hostname):
-        await asyncio.sleep(1)
-
         yam = Yamaha(hostname)
     
         # x = await yam.put("@MAIN:VOL", "Up 2 dB")
         # x = await yam.get("@MAIN:VOL")
         x = await yam.put("@MAIN:PWR", "Standby")
         print("test: response:", x)
+
+        await yam.close()
     
     ynca = YNCAServer().start()
+    await ynca.ready.wait()
 
     await test('127.0.0.1')
     # await test('CL-6EA47')
 
-    # Let it run for a few seconds then kill it
-    t = 3
-    print(f'main: sleep {t}')
-    await asyncio.sleep(t)
     print(f'main: stopping server')
     await ynca.wait_close()
     print('main: done')
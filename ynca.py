@@ -0,0 +1,43 @@
+""" YNCA wire format shared by yamaha.py and protocol.py """
+
+import socket
+import functools
+
+
+# replies that mean the request failed
+YNCA_ERRORS = frozenset((b"@UNDEFINED", b"@RESTRICTED", b"@ERROR"))
+
+# anything longer can't be one of them
+_ERRORS_LEN = max(map(len, YNCA_ERRORS))
+
+
+@functools.lru_cache(maxsize=256)
+def ynca_frame(name, value):
+    """ encoded NAME=VALUE request line.  requests come from a small fixed vocabulary """
+
+    return f"{name}={value}\r\n".encode()
+
+
+def decode_response(data):
+    """ Convert response bytes to a dict """
+
+    # replies always end in \r\n.  blank lines are skipped below anyway
+    response = data[:-2] if data.endswith(b'\r\n') else data
+
+    # check if response indicates error
+    if len(response) <= _ERRORS_LEN and response in YNCA_ERRORS:
+        return {'response': '@ERROR'}
+
+    lines = (line.partition(b"=") for line in response.split(b"\r\n"))
+    results = {name.decode(): value.rstrip().decode() for name, sep, value in lines if sep}
+    results['response'] = '@OK'
+
+    return results
+
+
+def set_nodelay(transport):
+    """ send the tiny YNCA frames right away rather than letting Nagle hold them back """
+
+    sock = transport.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)